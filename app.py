@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
+import asyncio
 import logging
 import os
 import re
-from typing import Dict, Any, List, Tuple, Optional
+from typing import Dict, Any, List, Tuple, Optional, Set
 
 import aiohttp
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -11,8 +12,14 @@ from telegram.ext import (
     CallbackQueryHandler, MessageHandler, ConversationHandler, filters
 )
 
-from db import init_db, save_filters, all_users_filters, was_already_sent, mark_sent
+from db import (
+    init_db, save_filters, all_users_filters, was_already_sent, mark_sent,
+    store_listings, search_listings, recent_listings, last_sent_price, prune_listings,
+)
+from dedup import RELIST_WINDOW_DAYS, shared_relist_index
+from matcher import KeywordMatcher, normalize_keyword, shared_matcher
 from scraper.auto24 import fetch_latest_listings, debug_fetch
+from scraper.planner import shared_plan, fetch_planned, route, stream_all
 
 # ------------ ЛОГИРОВАНИЕ ------------
 logging.basicConfig(
@@ -25,9 +32,13 @@ logger = logging.getLogger("car-sniper")
 BOT_TOKEN = os.getenv("BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN")
 SCAN_INTERVAL = int(os.getenv("SCAN_INTERVAL", "120"))  # 2 минуты
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")  # (опц.) кому разрешить /debug, /debugraw
+STREAM_HTML = os.getenv("STREAM_HTML", "0") == "1"  # разбор страниц по мере загрузки, рассылка до конца скачивания
+
+BACKFILL_LIMIT = int(os.getenv("BACKFILL_LIMIT", "10"))  # сколько старых объявлений прислать после сохранения фильтра
+LISTINGS_KEEP_DAYS = int(os.getenv("LISTINGS_KEEP_DAYS", "30"))  # сколько хранить увиденные объявления
 
 # Состояния мастера
-PRICE, YEAR, KM, BRANDS = range(4)
+PRICE, YEAR, KM, BRANDS, KEYWORDS = range(5)
 
 # 15 популярных брендов
 BRANDS_ALL = [
@@ -67,8 +78,25 @@ def fmt_int(x: Optional[int]) -> str:
         return "-"
     return f"{x:,}".replace(",", " ")
 
+def parse_keywords(s: str) -> Tuple[List[str], List[str]]:
+    """'Golf, 4x4, -defektiga' -> (['golf','4x4'], ['defektiga'])"""
+    inc: List[str] = []
+    exc: List[str] = []
+    # '|' — разделитель полей в тексте фильтра, поэтому считаем его запятой
+    for part in re.split(r"[,|]", s or ""):
+        part = part.strip()
+        neg = part.startswith("-")
+        k = normalize_keyword(part.lstrip("-"))
+        if not k:
+            continue
+        target = exc if neg else inc
+        if k not in target:
+            target.append(k)
+    return inc, exc
+
 def parse_filters_text(s: str) -> Dict[str, Any]:
-    out = {"price_min":None,"price_max":None,"year_min":None,"year_max":None,"km_max":None,"brands":[]}
+    out = {"price_min":None,"price_max":None,"year_min":None,"year_max":None,"km_max":None,"brands":[],
+           "keywords":[],"exclude":[]}
     if not s:
         return out
     parts = s.split("|")
@@ -87,10 +115,19 @@ def parse_filters_text(s: str) -> Dict[str, Any]:
     if len(parts) > 3 and parts[3]:
         brands = [normalize_brand(b) for b in re.split(r"[,\s]+", parts[3]) if b.strip()]
         out["brands"] = brands
+    if len(parts) > 4 and parts[4]:
+        out["keywords"], out["exclude"] = parse_keywords(parts[4])
     return out
 
-def is_match(item: Dict[str, Any], f: Dict[str, Any]) -> bool:
-    """Мягкая фильтрация: пустые поля у объявления не отсекают."""
+def listing_text(item: Dict[str, Any]) -> str:
+    return f"{item.get('brand') or ''} {item.get('title') or ''}"
+
+def is_match(item: Dict[str, Any], f: Dict[str, Any], hits: Optional[Set[str]] = None) -> bool:
+    """
+    Мягкая фильтрация: пустые поля у объявления не отсекают.
+    hits — ключевые слова, уже найденные в объявлении общим матчером;
+    если не переданы, ищем только слова этого фильтра.
+    """
     price = item.get("price_eur")
     year  = item.get("year")
     km    = item.get("odometer_km")
@@ -109,6 +146,15 @@ def is_match(item: Dict[str, Any], f: Dict[str, Any]) -> bool:
     if f["brands"]:
         if not brand or brand not in f["brands"]:
             return False
+    keywords = f.get("keywords") or []
+    exclude  = f.get("exclude") or []
+    if keywords or exclude:
+        if hits is None:
+            hits = KeywordMatcher(keywords + exclude).find(listing_text(item))
+        if any(k in hits for k in exclude):
+            return False
+        if keywords and not any(k in hits for k in keywords):
+            return False
     return True
 
 # --- извлечение «модели» из title для красивого заголовка ---
@@ -135,7 +181,8 @@ def price_change_arrow(prev_price: Optional[int], new_price: Optional[int]) -> s
         return " ⬆️"
     return ""
 
-async def send_listing(chat_id: int, ctx: ContextTypes.DEFAULT_TYPE, listing: Dict[str, Any], prev_price: Optional[int]=None):
+async def send_listing(chat_id: int, ctx: ContextTypes.DEFAULT_TYPE, listing: Dict[str, Any], prev_price: Optional[int]=None,
+                       relist: bool=False):
     brand = listing.get("brand") or "-"
     raw_title = listing.get("title") or ""
     model = extract_model_from_title(raw_title, brand) or raw_title
@@ -148,9 +195,11 @@ async def send_listing(chat_id: int, ctx: ContextTypes.DEFAULT_TYPE, listing: Di
     site  = listing.get("site") or "auto24.ee"
 
     arrow = price_change_arrow(prev_price, price)
+    relist_txt = "♻️ _Перевыставлено: эту машину уже присылали_\n\n" if relist else ""
 
     text = (
         f"🔔 *{brand} {model}*\n\n"
+        f"{relist_txt}"
         f"Марка: *{brand}*\n"
         f"Год: *{year}*\n"
         f"Пробег: *{km} км*\n"
@@ -216,7 +265,8 @@ async def cmd_debugraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ------------ МАСТЕР ФИЛЬТРОВ ------------
 async def filter_entry(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["filt"] = {"price_min": None,"price_max": None,"year_min": None,"year_max": None,"km_max": None,"brands": []}
+    context.user_data["filt"] = {"price_min": None,"price_max": None,"year_min": None,"year_max": None,"km_max": None,"brands": [],
+                                 "keywords": [],"exclude": []}
     await update.message.reply_text("Укажи диапазон цены (например: 2000-6000):")
     return PRICE
 
@@ -279,61 +329,155 @@ async def brands_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     if data == "confirm:save":
-        f = context.user_data.get("filt", {})
-        price_s  = f"{f.get('price_min','')}-{f.get('price_max','')}"
-        year_s   = f"{f.get('year_min','')}-{f.get('year_max','')}"
-        km_s     = f"{f.get('km_max','')}"
-        brands_s = ",".join(f.get("brands", []))
-        s = f"{price_s}|{year_s}|{km_s}|{brands_s}"
-
-        chat_id = q.message.chat.id
-        save_filters(chat_id, s)
+        await q.edit_message_text(
+            "Ключевые слова через запятую (например: Golf, Avensis, 4x4).\n"
+            "Исключения — с минусом: -defektiga\n"
+            "Отправь «-», чтобы пропустить."
+        )
+        return KEYWORDS
+
+async def filter_keywords(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    t = (update.message.text or "").strip()
+    f = context.user_data.get("filt", {})
+    f["keywords"], f["exclude"] = parse_keywords("" if t == "-" else t)
+
+    price_s  = f"{f.get('price_min','')}-{f.get('price_max','')}"
+    year_s   = f"{f.get('year_min','')}-{f.get('year_max','')}"
+    km_s     = f"{f.get('km_max','')}"
+    brands_s = ",".join(f.get("brands", []))
+    kw_s     = ",".join(f["keywords"] + ["-" + k for k in f["exclude"]])
+    s = f"{price_s}|{year_s}|{km_s}|{brands_s}|{kw_s}"
+
+    chat_id = update.effective_chat.id
+    save_filters(chat_id, s)
+    await update.message.reply_text("✅ Фильтр сохранён!")
+
+    if f["keywords"]:
+        await backfill(chat_id, context, parse_filters_text(s))
+    return ConversationHandler.END
 
-        await q.edit_message_text("✅ Фильтр сохранён!")
-        return ConversationHandler.END
+async def backfill(chat_id: int, ctx: ContextTypes.DEFAULT_TYPE, f: Dict[str, Any]):
+    """Дозаполнение: подходящие объявления из уже сохранённых (FTS5 по ключевым словам)."""
+    sent = 0
+    for it in search_listings(f["keywords"], limit=BACKFILL_LIMIT * 5):
+        if sent >= BACKFILL_LIMIT:
+            break
+        if not is_match(it, f):
+            continue
+        if was_already_sent(chat_id, it["id"], it.get("price_eur")):
+            continue
+        try:
+            await send_listing(chat_id, ctx, it, None)
+            mark_sent(chat_id, it["id"], it.get("price_eur"), it.get("title") or "", it.get("url") or "")
+            sent += 1
+        except Exception as e:
+            logger.exception("Backfill send failed to %s: %s", chat_id, e)
+    logger.info("Дозаполнение для chat_id=%s: %d", chat_id, sent)
 
 async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Отменено.")
     return ConversationHandler.END
 
 # ------------ СКАН И РАССЫЛКА ------------
+async def dispatch_listing(context: ContextTypes.DEFAULT_TYPE, users: List[Tuple[int, Dict[str, Any]]],
+                           it: Dict[str, Any], audience: Optional[Set[int]], hits: Set[str],
+                           stats: Dict[int, List[int]]):
+    """Рассылка одного объявления подходящим пользователям (audience=None — всем)."""
+    listing_id = it.get("id") or it.get("url")
+    if not listing_id:
+        return
+    for user_id, f in users:
+        if audience is not None and user_id not in audience:
+            continue
+
+        # если уже отправляли такую же цену — пропускаем
+        if was_already_sent(user_id, listing_id, it.get("price_eur")):
+            continue
+
+        if is_match(it, f, hits):
+            prev_price = None  # можно доработать: достать последнюю запись по listing_id для стрелочки
+            relist = False
+            if it.get("relist_of"):
+                was_sent, prev = last_sent_price(user_id, it["relist_of"])
+                if was_sent:
+                    # эту машину (под любым из прежних id) уже присылали — повторяем только если подешевела
+                    if it.get("price_eur") is None or prev is None or it["price_eur"] >= prev:
+                        stats[user_id][1] += 1
+                        continue
+                    prev_price, relist = prev, True
+            try:
+                await send_listing(user_id, context, it, prev_price, relist)
+                mark_sent(user_id, listing_id, it.get("price_eur"), it.get("title") or "", it.get("url") or "")
+                stats[user_id][0] += 1
+            except Exception as e:
+                logger.exception("Send failed to %s: %s", user_id, e)
+
+async def _fetch_buffered(session, plan) -> List[Tuple[Dict[str, Any], Optional[Set[int]]]]:
+    latest, planned = await asyncio.gather(
+        fetch_latest_listings(session),
+        fetch_planned(session, plan),
+        return_exceptions=True,
+    )
+    if isinstance(latest, Exception):
+        logger.error("Fetch error: %s", latest)
+        latest = []
+    if isinstance(planned, Exception):
+        logger.error("Planned fetch error: %s", planned)
+        planned = []
+
+    # «свежая» лента — для всех; поисковые страницы — только своим подписчикам
+    extra, audience = route(planned)
+    seen = {it["id"] for it in latest}
+    return [(it, None) for it in latest] + [(it, audience[it["id"]]) for it in extra if it["id"] not in seen]
+
 async def scan_job(context: ContextTypes.DEFAULT_TYPE):
+    users = [(uid, parse_filters_text(t or "")) for uid, t in all_users_filters()]
+    # при тысячах фильтров планирование не должно блокировать бота
+    plan = await asyncio.to_thread(shared_plan, users)
+
+    # один проход общего матчера на объявление вместо «заголовок × слова каждого пользователя»
+    matcher = shared_matcher(k for _, f in users for k in f["keywords"] + f["exclude"])
+    # перевыставления: та же машина под новым id / с другой версии сайта
+    relists = shared_relist_index(lambda: recent_listings(RELIST_WINDOW_DAYS))
+
+    stats: Dict[int, List[int]] = {uid: [0, 0] for uid, _ in users}  # отправлено, скрыто перевыставлений
+    listings: Dict[str, Dict[str, Any]] = {}
+
+    async def handle(it: Dict[str, Any], audience: Optional[Set[int]]):
+        it["relist_of"] = relists.check_and_add(it)
+        listings[it["id"]] = it
+        await dispatch_listing(context, users, it, audience, matcher.find(listing_text(it)), stats)
+
     async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=45)) as session:
-        try:
-            listings = await fetch_latest_listings(session)
-        except Exception as e:
-            logger.exception("Fetch error: %s", e)
-            return
+        if STREAM_HTML:
+            # рассылаем верхние (самые свежие) карточки, пока страницы ещё докачиваются
+            try:
+                async for it, audience in stream_all(session, plan):
+                    await handle(it, audience)
+            except Exception as e:
+                logger.exception("Stream error: %s", e)
+            batch = []
+        else:
+            batch = await _fetch_buffered(session, plan)
+    for it, audience in batch:
+        await handle(it, audience)
 
     if not listings:
         logger.info("Новых объявлений нет")
         return
 
-    logger.info("Найдено объявлений: %d. Пример: %s", len(listings), listings[0].get("url",""))
-
-    users: List[Tuple[int, str]] = all_users_filters()
-    for user_id, filt_text in users:
-        f = parse_filters_text(filt_text or "")
-        matched = 0
-        for it in listings:
-            listing_id = it.get("id") or it.get("url")
-            if not listing_id:
-                continue
+    first = next(iter(listings.values()))
+    logger.info("Найдено объявлений: %d. Пример: %s", len(listings), first.get("url",""))
 
-            # если уже отправляли такую же цену — пропускаем
-            if was_already_sent(user_id, listing_id, it.get("price_eur")):
-                continue
-
-            if is_match(it, f):
-                prev_price = None  # можно доработать: достать последнюю запись по listing_id для стрелочки
-                try:
-                    await send_listing(user_id, context, it, prev_price)
-                    mark_sent(user_id, listing_id, it.get("price_eur"), it.get("title") or "", it.get("url") or "")
-                    matched += 1
-                except Exception as e:
-                    logger.exception("Send failed to %s: %s", user_id, e)
+    try:
+        store_listings(listings.values())
+        # окно перевыставлений читает эти строки — храним не меньше его
+        prune_listings(max(LISTINGS_KEEP_DAYS, RELIST_WINDOW_DAYS))
+    except Exception as e:
+        logger.exception("Store listings failed: %s", e)
 
-        logger.info("Для chat_id=%s отправлено объявлений: %d", user_id, matched)
+    for user_id, (matched, suppressed) in stats.items():
+        logger.info("Для chat_id=%s отправлено объявлений: %d (перевыставлений скрыто: %d)", user_id, matched, suppressed)
 
 # ------------ СБОРКА И ЗАПУСК ------------
 def build_app():
@@ -349,6 +493,7 @@ def build_app():
             YEAR:   [MessageHandler(filters.TEXT & ~filters.COMMAND, filter_year)],
             KM:     [MessageHandler(filters.TEXT & ~filters.COMMAND, filter_km)],
             BRANDS: [CallbackQueryHandler(brands_toggle)],
+            KEYWORDS: [MessageHandler(filters.TEXT & ~filters.COMMAND, filter_keywords)],
         },
         fallbacks=[CommandHandler("cancel", cmd_cancel)],
         allow_reentry=True
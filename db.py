@@ -1,7 +1,7 @@
 import os
 import sqlite3
-from datetime import datetime, timezone
-from typing import List, Tuple, Optional
+from datetime import datetime, timezone, timedelta
+from typing import List, Tuple, Optional, Dict, Any, Iterable
 
 DB_PATH = os.getenv("DB_PATH", "data.db")
 
@@ -39,6 +39,46 @@ def init_db():
         PRIMARY KEY (chat_id, listing_id, price_eur)
     )
     """)
+    # Все увиденные объявления — для дозаполнения при сохранении фильтра
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS listings (
+        rowid        INTEGER PRIMARY KEY,
+        listing_id   TEXT UNIQUE NOT NULL,
+        title        TEXT,
+        brand        TEXT,
+        price_eur    INTEGER,
+        year         INTEGER,
+        odometer_km  INTEGER,
+        url          TEXT,
+        site         TEXT,
+        fetched_at   TEXT NOT NULL,
+        first_seen   TEXT
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS listings_fetched_at ON listings(fetched_at)")
+    # Полнотекстовый индекс по заголовку и марке (external content → без дублей текста)
+    try:
+        cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5(
+            title, brand,
+            content='listings', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """)
+        cur.executescript("""
+        CREATE TRIGGER IF NOT EXISTS listings_ai AFTER INSERT ON listings BEGIN
+            INSERT INTO listings_fts(rowid, title, brand) VALUES (new.rowid, new.title, new.brand);
+        END;
+        CREATE TRIGGER IF NOT EXISTS listings_ad AFTER DELETE ON listings BEGIN
+            INSERT INTO listings_fts(listings_fts, rowid, title, brand) VALUES ('delete', old.rowid, old.title, old.brand);
+        END;
+        CREATE TRIGGER IF NOT EXISTS listings_au AFTER UPDATE OF title, brand ON listings BEGIN
+            INSERT INTO listings_fts(listings_fts, rowid, title, brand) VALUES ('delete', old.rowid, old.title, old.brand);
+            INSERT INTO listings_fts(rowid, title, brand) VALUES (new.rowid, new.title, new.brand);
+        END;
+        """)
+    except sqlite3.OperationalError:
+        pass  # sqlite без FTS5 — дозаполнение просто не работает
     conn.commit()
 
 def save_filters(chat_id: int, filters_text: str):
@@ -74,6 +114,21 @@ def was_already_sent(chat_id: int, listing_id: str, price_eur: Optional[int]) ->
     """, (chat_id, listing_id, price_eur, price_eur))
     return cur.fetchone() is not None
 
+def last_sent_price(chat_id: int, listing_ids: List[str]) -> Tuple[bool, Optional[int]]:
+    """(отправляли ли хоть одно из listing_ids, цена последней такой отправки)"""
+    if not listing_ids:
+        return False, None
+    cur = db().cursor()
+    marks = ",".join("?" * len(listing_ids))
+    cur.execute(f"""
+        SELECT price_eur FROM sent
+        WHERE chat_id=? AND listing_id IN ({marks})
+        ORDER BY sent_at DESC
+        LIMIT 1
+    """, (chat_id, *listing_ids))
+    row = cur.fetchone()
+    return (True, row["price_eur"]) if row else (False, None)
+
 def mark_sent(chat_id: int, listing_id: str, price_eur: Optional[int], title: str, url: str):
     ts = datetime.now(timezone.utc).isoformat()
     conn = db()
@@ -83,3 +138,90 @@ def mark_sent(chat_id: int, listing_id: str, price_eur: Optional[int], title: st
         VALUES (?, ?, ?, ?, ?, ?)
     """, (chat_id, listing_id, price_eur, title or "", url or "", ts))
     conn.commit()
+
+def store_listings(items: Iterable[Dict[str, Any]]):
+    conn = db()
+    cur = conn.cursor()
+    now = datetime.now(timezone.utc).isoformat()
+    rows = [
+        (it.get("id") or it.get("url"), it.get("title") or "", it.get("brand") or "",
+         it.get("price_eur"), it.get("year"), it.get("odometer_km"),
+         it.get("url") or "", it.get("site") or "", it.get("fetched_at") or now,
+         it.get("fetched_at") or now)  # first_seen: при обновлении не трогаем
+        for it in items if it.get("id") or it.get("url")
+    ]
+    cur.executemany("""
+        INSERT INTO listings (listing_id, title, brand, price_eur, year, odometer_km, url, site, fetched_at, first_seen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(listing_id) DO UPDATE SET
+            title=excluded.title,
+            brand=excluded.brand,
+            price_eur=excluded.price_eur,
+            year=excluded.year,
+            odometer_km=excluded.odometer_km,
+            url=excluded.url,
+            fetched_at=excluded.fetched_at
+        WHERE title IS NOT excluded.title
+           OR brand IS NOT excluded.brand
+           OR price_eur IS NOT excluded.price_eur
+           OR year IS NOT excluded.year
+           OR odometer_km IS NOT excluded.odometer_km
+           OR url IS NOT excluded.url
+    """, rows)
+    conn.commit()
+
+def _row_to_listing(r) -> Dict[str, Any]:
+    return {
+        "id": r["listing_id"],
+        "site": r["site"],
+        "url": r["url"],
+        "title": r["title"],
+        "price_eur": r["price_eur"],
+        "year": r["year"],
+        "odometer_km": r["odometer_km"],
+        "brand": r["brand"] or None,
+        "fetched_at": r["fetched_at"],
+        "first_seen": r["first_seen"] or r["fetched_at"],
+    }
+
+def recent_listings(days: int) -> List[Dict[str, Any]]:
+    """Объявления, обновлявшиеся за последние days дней, в порядке первого появления."""
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    cur = db().cursor()
+    cur.execute("""
+        SELECT * FROM listings WHERE fetched_at >= ?
+        ORDER BY COALESCE(first_seen, fetched_at), rowid
+    """, (since,))
+    return [_row_to_listing(r) for r in cur.fetchall()]
+
+def prune_listings(days: int) -> int:
+    """Удаляем объявления, не обновлявшиеся дольше days дней (FTS чистит триггер listings_ad)."""
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    conn = db()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM listings WHERE fetched_at < ?", (since,))
+    conn.commit()
+    return cur.rowcount
+
+def _fts_query(keywords: Iterable[str]) -> str:
+    # каждое слово — фраза в кавычках, чтобы "4x4" или "x-trail" не ломали синтаксис FTS
+    phrases = ['"' + k.replace('"', '""') + '"' for k in keywords if k.strip()]
+    return " OR ".join(phrases)
+
+def search_listings(keywords: Iterable[str], limit: int = 50) -> List[Dict[str, Any]]:
+    """Поиск по сохранённым объявлениям (FTS5), самые свежие первыми."""
+    q = _fts_query(keywords)
+    if not q:
+        return []
+    cur = db().cursor()
+    try:
+        cur.execute("""
+            SELECT l.* FROM listings_fts
+            JOIN listings l ON l.rowid = listings_fts.rowid
+            WHERE listings_fts MATCH ?
+            ORDER BY l.fetched_at DESC
+            LIMIT ?
+        """, (q, limit))
+    except sqlite3.OperationalError:
+        return []
+    return [_row_to_listing(r) for r in cur.fetchall()]
@@ -0,0 +1,203 @@
+import hashlib
+import os
+import random
+import re
+import time
+from datetime import datetime
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
+
+# MinHash + LSH по «отпечатку» машины: марка, токены модели, год, полосы пробега и цены.
+# Перевыставленная машина (новый id, другая версия сайта) попадает в те же корзины,
+# и проверка стоит O(число полос), а не O(число недавних объявлений).
+NUM_PERM = 32
+BANDS, ROWS = 16, 2                      # порог кандидата ≈ (1/16)^(1/2) ≈ 0.25
+RELIST_THRESHOLD = float(os.getenv("RELIST_THRESHOLD", "0.6"))  # точный Жаккар для подтверждения
+RELIST_WINDOW_DAYS = int(os.getenv("RELIST_WINDOW_DAYS", "14"))
+RELIST_MAX_ITEMS = int(os.getenv("RELIST_MAX_ITEMS", "20000"))
+
+KM_BAND = 10_000
+PRICE_BAND = 500
+
+_PRIME = (1 << 61) - 1
+_rnd = random.Random(24)
+_PERMS = [(_rnd.randrange(1, _PRIME), _rnd.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_NUM_RE = r"(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)"
+
+def _model_tokens(title: str, brand: Optional[str]) -> List[str]:
+    t = (title or "").lower()
+    t = re.sub(_NUM_RE + r"\s*€", " ", t)
+    t = re.sub(_NUM_RE + r"\s*km\b", " ", t)
+    t = re.sub(r"\b(19|20)\d{2}\b", " ", t)
+    skip = set(re.findall(r"[\w.]+", (brand or "").lower())) | {"mercedes", "benz", "vw"}
+    return [w for w in re.findall(r"[\w.]+", t) if w not in skip][:6]
+
+def features(item: Dict[str, Any]) -> Set[str]:
+    out: Set[str] = set()
+    brand = (item.get("brand") or "").lower()
+    if brand:
+        out.add("b:" + brand)
+    for w in _model_tokens(item.get("title") or "", item.get("brand")):
+        out.add("m:" + w)
+    if item.get("year"):
+        out.add(f"y:{item['year']}")
+    # по две полосы (floor и round), чтобы мелкая разница на границе полосы не разводила машины
+    km = item.get("odometer_km")
+    if km is not None:
+        out.add(f"kf:{km // KM_BAND}")
+        out.add(f"kr:{round(km / KM_BAND)}")
+    price = item.get("price_eur")
+    if price is not None:
+        out.add(f"pf:{price // PRICE_BAND}")
+        out.add(f"pr:{round(price / PRICE_BAND)}")
+    return out
+
+def _model(item: Dict[str, Any]) -> Optional[str]:
+    """Первое слово модели ("avensis", "golf") — без совпадения это другая машина."""
+    tokens = _model_tokens(item.get("title") or "", item.get("brand"))
+    return tokens[0] if tokens else None
+
+def _comparable(item: Dict[str, Any]) -> bool:
+    """Без цены и пробега «та же машина» не отличить от другой такой же модели."""
+    return (item.get("price_eur") is not None and item.get("odometer_km") is not None
+            and len(features(item)) >= 5)
+
+def _signature(feats: Set[str]) -> List[int]:
+    hs = [int.from_bytes(hashlib.blake2b(f.encode(), digest_size=8).digest(), "big") for f in feats]
+    return [min((a * h + b) % _PRIME for h in hs) for a, b in _PERMS]
+
+def _band_keys(sig: List[int]) -> List[Tuple[int, Tuple[int, ...]]]:
+    return [(i, tuple(sig[i * ROWS:(i + 1) * ROWS])) for i in range(BANDS)]
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+class RelistIndex:
+    """
+    Окно недавних объявлений с LSH-корзинами для поиска почти-дублей.
+    Перевыставления одной машины собираются в кластер по корню (первому id),
+    чтобы цепочка A -> B -> C не рвалась, если B пользователю не отправляли.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[str]] = {}
+        self._clusters: Dict[str, Set[str]] = {}
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, listing_id: str):
+        e = self._entries.pop(listing_id, None)
+        if not e:
+            return
+        for key in e["keys"]:
+            ids = self._buckets.get(key)
+            if ids:
+                ids.discard(listing_id)
+                if not ids:
+                    del self._buckets[key]
+        members = self._clusters.get(e["root"])
+        if members is not None:
+            members.discard(listing_id)
+            if not members:
+                del self._clusters[e["root"]]
+
+    def _evict(self, now: float):
+        cutoff = now - RELIST_WINDOW_DAYS * 86400
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if oldest["seen"] >= cutoff and len(self._entries) <= RELIST_MAX_ITEMS:
+                break
+            self._remove(oldest_id)
+
+    def add(self, item: Dict[str, Any], seen: Optional[float] = None, root: Optional[str] = None):
+        listing_id = item.get("id") or item.get("url")
+        if not listing_id or not _comparable(item):
+            return
+        feats = features(item)
+        seen = time.time() if seen is None else seen
+        old = self._entries.get(listing_id)
+        if old is not None:
+            self._remove(listing_id)
+            seq, root = old["seq"], old["root"]  # кластер объявления не меняется
+        else:
+            self._seq += 1
+            seq = self._seq
+        root = root or listing_id
+        keys = _band_keys(_signature(feats))
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(listing_id)
+        self._clusters.setdefault(root, set()).add(listing_id)
+        self._entries[listing_id] = {"feats": feats, "keys": keys, "seq": seq, "seen": seen, "root": root,
+                                     "brand": item.get("brand"), "year": item.get("year"), "model": _model(item),
+                                     "km": item.get("odometer_km")}
+        self._evict(seen)
+
+    def find(self, item: Dict[str, Any]) -> Optional[str]:
+        """id более раннего объявления той же машины (или None)."""
+        listing_id = item.get("id") or item.get("url")
+        if not _comparable(item):
+            return None
+        feats = features(item)
+        model = _model(item)
+        own = self._entries.get(listing_id)
+        own_seq = own["seq"] if own else self._seq + 1
+
+        cands: Set[str] = set()
+        for key in _band_keys(_signature(feats)):
+            cands |= self._buckets.get(key, set())
+        cands.discard(listing_id)
+
+        best, best_key = None, None
+        for cid in cands:
+            e = self._entries[cid]
+            if e["seq"] >= own_seq:
+                continue  # «оригинал» — только то, что мы видели раньше
+            if item.get("year") and e["year"] and item["year"] != e["year"]:
+                continue
+            if item.get("brand") and e["brand"] and item["brand"] != e["brand"]:
+                continue
+            if model and e["model"] and model != e["model"]:
+                continue  # та же марка, год и цена, но другая модель
+            km = item.get("odometer_km")
+            if km is not None and e["km"] is not None and abs(km - e["km"]) > KM_BAND:
+                continue  # сильно разный пробег — другая машина
+            score = _jaccard(feats, e["feats"])
+            if score < RELIST_THRESHOLD:
+                continue
+            key = (score, -e["seq"])  # самый похожий, при равенстве — самый ранний
+            if best_key is None or key > best_key:
+                best, best_key = cid, key
+        return best
+
+    def check_and_add(self, item: Dict[str, Any], seen: Optional[float] = None) -> Optional[List[str]]:
+        """Более ранние id той же машины (весь кластер, от старых к новым) или None."""
+        listing_id = item.get("id") or item.get("url")
+        orig = self.find(item)
+        self.add(item, seen, root=self._entries[orig]["root"] if orig else None)
+        own = self._entries.get(listing_id)
+        if own is None:
+            return None
+        earlier = [m for m in self._clusters.get(own["root"], ()) if self._entries[m]["seq"] < own["seq"]]
+        return sorted(earlier, key=lambda m: self._entries[m]["seq"]) or None
+
+_shared: Optional[RelistIndex] = None
+
+def shared_relist_index(seed: Optional[Callable[[], List[Dict[str, Any]]]] = None) -> RelistIndex:
+    """
+    Общий индекс процесса; при первом вызове заполняется из seed() (недавние объявления из БД,
+    по порядку first_seen). Заполняем через check_and_add, чтобы кластеры пережили перезапуск.
+    """
+    global _shared
+    if _shared is None:
+        _shared = RelistIndex()
+        for it in (seed() if seed else []):
+            try:
+                seen = datetime.fromisoformat(it["fetched_at"]).timestamp()
+            except (KeyError, TypeError, ValueError):
+                seen = None
+            _shared.check_and_add(it, seen)
+    return _shared
@@ -0,0 +1,94 @@
+import re
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+
+# Ключевые слова сравниваем в нижнем регистре, без диакритики (как FTS5 с remove_diacritics)
+# и только целыми токенами: "golf" совпадёт с "VW Golf Variant", но не с "Golfplatz".
+_WORD_CHARS = re.compile(r"\w")
+
+def fold(s: str) -> str:
+    """'Škoda' -> 'skoda'"""
+    s = unicodedata.normalize("NFKD", s or "")
+    return "".join(ch for ch in s if not unicodedata.combining(ch)).lower()
+
+def normalize_keyword(k: str) -> str:
+    return " ".join(fold(k).split())
+
+def _is_word_char(ch: str) -> bool:
+    return bool(_WORD_CHARS.match(ch))
+
+class KeywordMatcher:
+    """
+    Aho–Corasick по всем ключевым словам всех пользователей.
+    Один проход по заголовку находит все подписанные слова сразу,
+    вместо перебора «каждый заголовок × каждое слово каждого пользователя».
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+        self.keywords: Set[str] = set()
+        for k in keywords:
+            k = normalize_keyword(k)
+            if k and k not in self.keywords:
+                self.keywords.add(k)
+                self._add(k)
+        self._build()
+
+    def _add(self, word: str):
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(word)
+
+    def _build(self):
+        q = deque(self._goto[0].values())
+        while q:
+            node = q.popleft()
+            for ch, nxt in self._goto[node].items():
+                q.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                cand = self._goto[f].get(ch, 0)
+                self._fail[nxt] = cand if cand != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> Set[str]:
+        """Множество ключевых слов, встретившихся в тексте целыми токенами."""
+        hits: Set[str] = set()
+        if not self.keywords or not text:
+            return hits
+        t = normalize_keyword(text)
+        node = 0
+        for i, ch in enumerate(t):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for word in self._out[node]:
+                start = i - len(word) + 1
+                if start > 0 and _is_word_char(t[start - 1]) and _is_word_char(word[0]):
+                    continue
+                if i + 1 < len(t) and _is_word_char(t[i + 1]) and _is_word_char(word[-1]):
+                    continue
+                hits.add(word)
+        return hits
+
+# Матчер пересобираем только при изменении набора слов (сохранили/поменяли фильтр).
+_cached: Optional[KeywordMatcher] = None
+
+def shared_matcher(keywords: Iterable[str]) -> KeywordMatcher:
+    global _cached
+    ks = {normalize_keyword(k) for k in keywords if normalize_keyword(k)}
+    if _cached is None or _cached.keywords != ks:
+        _cached = KeywordMatcher(ks)
+    return _cached
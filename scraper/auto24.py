@@ -1,13 +1,37 @@
+import codecs
 import os
 import re
-from typing import List, Dict, Any, Optional
+from html.parser import HTMLParser
+from typing import List, Dict, Any, Optional, AsyncIterator
 from datetime import datetime, timezone
+from urllib.parse import urlencode
 from bs4 import BeautifulSoup
 
 # Мобилка у тебя отдаёт 200 — используем её как основной источник
 MOBILE_URL  = "https://m.auto24.ee/soidukid/kasutatud/"
 DESKTOP_URL = "https://www.auto24.ee/soidukid/kasutatud/"  # запасной
 
+# Поиск с параметрами (для планировщика запросов по фильтрам)
+SEARCH_URL = "https://m.auto24.ee/kasutatud/nimekiri.php"
+SEARCH_PARAMS = {
+    "type": "a",        # a=100 — легковые
+    "sort": "ae",       # сортировка выдачи
+    "brand": "b",
+    "year_min": "f1", "year_max": "f2",
+    "price_min": "g1", "price_max": "g2",
+    "km_max": "l2",
+}
+
+# Планировщик берёт только первую страницу выдачи, поэтому она должна быть «новые сверху»
+# (значение опции сортировки по дате добавления; при смене вёрстки сайта — переопределить).
+SEARCH_SORT_NEWEST = os.getenv("AUTO24_SORT_NEWEST", "8")
+
+# Числовые id марок в поиске auto24: "Toyota:NN,BMW:NN". Марки без id ищем без марки.
+AUTO24_BRAND_IDS = {
+    k.strip(): v.strip()
+    for k, v in (p.split(":", 1) for p in os.getenv("AUTO24_BRAND_IDS", "").split(",") if ":" in p)
+}
+
 # Прокси-шаблон (например ScraperAPI). Если пусто — идём напрямую.
 SCRAPER_URL_TMPL = os.getenv("SCRAPER_URL_TMPL")
 
@@ -64,7 +88,7 @@ def extract_price(text: str) -> Optional[int]:
     Примеры совпадений: '14 990 €', '2990€'
     """
     cands: List[int] = []
-    for m in re.finditer(r"(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)\s*€", text):
+    for m in re.finditer(r"(?<!\d)(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)\s*€", text):
         v = _to_int(m.group(1))
         if v is not None and PRICE_MIN <= v <= PRICE_MAX:
             cands.append(v)
@@ -79,7 +103,7 @@ def extract_km(text: str) -> Optional[int]:
     Примеры: '245 000 km', '125000km'
     """
     cands: List[int] = []
-    for m in re.finditer(r"(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)\s*(?:km|KM|Km|kM)\b", text):
+    for m in re.finditer(r"(?<!\d)(\d{1,3}(?:[ \u00a0]\d{3})+|\d+)\s*(?:km|KM|Km|kM)\b", text):
         v = _to_int(m.group(1))
         if v is not None and 0 < v <= KM_MAX:
             cands.append(v)
@@ -115,17 +139,40 @@ def _extract_ad_id(url: str) -> Optional[str]:
     if m: return m.group(1)
     return None
 
-def _parse_card_text(tag) -> Dict[str, Any]:
-    card = tag.find_parent(["article","div","li"]) or tag
+CARD_TAGS = ["article","div","li"]
+
+def _parse_card_text(tag, card=None) -> Dict[str, Any]:
+    card = card or tag.find_parent(CARD_TAGS) or tag
     text = " ".join(card.get_text(" ").split())
-    title = tag.get_text(strip=True) or "Listing"
+    title = " ".join(tag.get_text(" ").split()) or "Listing"
+    return (title,) + _parse_fields(text)
 
+def _parse_fields(text: str):
     price = extract_price(text)
     km    = extract_km(text)
     year  = extract_year(text)
     brand = guess_brand(text)
+    return price, year, km, brand
+
+def _listing(ad_id: str, url: str, title: str, price, year, km, brand) -> Dict[str, Any]:
+    return {
+        "id": f"auto24:{ad_id}",
+        "site": "auto24.ee",
+        "url": url,
+        "title": title,
+        "price_eur": price,
+        "year": year,
+        "odometer_km": km,
+        "brand": brand,
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+    }
 
-    return title, price, year, km, brand
+def _is_ad_url(url: Optional[str]) -> bool:
+    if not url:
+        return False
+    if "session.php" in url or "login.php" in url:
+        return False
+    return "soidukid" in url
 
 def _collect_from_mobile(soup: BeautifulSoup) -> List[Dict[str, Any]]:
     items: List[Dict[str, Any]] = []
@@ -138,27 +185,13 @@ def _collect_from_mobile(soup: BeautifulSoup) -> List[Dict[str, Any]]:
         a = tag.find("a", href=True) or tag
         url = _norm_url(a.get("href"))
         if not url: continue
-        title, price, year, km, brand = _parse_card_text(a)
-        items.append({
-            "id": f"auto24:{ad_id}",
-            "site": "auto24.ee",
-            "url": url,
-            "title": title,
-            "price_eur": price,
-            "year": year,
-            "odometer_km": km,
-            "brand": brand,
-            "fetched_at": datetime.now(timezone.utc).isoformat(),
-        })
+        title, price, year, km, brand = _parse_card_text(a, card=tag)
+        items.append(_listing(ad_id, url, title, price, year, km, brand))
 
     # 2) Ссылки, похожие на объявления
     for a in soup.find_all("a", href=True):
         url = _norm_url(a["href"])
-        if not url:
-            continue
-        if "session.php" in url or "login.php" in url:
-            continue
-        if "soidukid" not in url:
+        if not _is_ad_url(url):
             continue
 
         ad_id = _extract_ad_id(url)
@@ -166,17 +199,7 @@ def _collect_from_mobile(soup: BeautifulSoup) -> List[Dict[str, Any]]:
             continue
 
         title, price, year, km, brand = _parse_card_text(a)
-        items.append({
-            "id": f"auto24:{ad_id}",
-            "site": "auto24.ee",
-            "url": url,
-            "title": title,
-            "price_eur": price,
-            "year": year,
-            "odometer_km": km,
-            "brand": brand,
-            "fetched_at": datetime.now(timezone.utc).isoformat(),
-        })
+        items.append(_listing(ad_id, url, title, price, year, km, brand))
 
     # дедуп
     seen = set()
@@ -188,6 +211,150 @@ def _collect_from_mobile(soup: BeautifulSoup) -> List[Dict[str, Any]]:
         uniq.append(it)
     return uniq
 
+# ---------- ПОТОКОВЫЙ РАЗБОР ----------
+# Тот же сборщик, что _collect_from_mobile, но без DOM: карточка отдаётся,
+# как только закрылся её тег, пока страница ещё докачивается.
+STREAM_CHUNK = 16 * 1024
+CARD_TEXT_MAX = 4000  # длиннее — это уже обёртка страницы, а не карточка
+
+LIST_TAGS = ("ul", "ol")
+
+class _CardStreamParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._stack: List[Dict[str, Any]] = []  # открытые article/div/li, ul/ol, [data-id] и <a>
+        self._skip = 0                          # внутри <script>/<style>
+        self.ready: List[Dict[str, Any]] = []
+
+    def pop_ready(self) -> List[Dict[str, Any]]:
+        out, self.ready = self.ready, []
+        return out
+
+    def _boundary(self):
+        # граница элемента = пробел, как get_text(" ") у BeautifulSoup;
+        # сами куски текста склеиваем как есть — feed() может порезать слово посередине
+        for e in self._stack:
+            if e["text"] is not None:
+                e["text"].append(" ")
+
+    def _close_to(self, i: int):
+        while len(self._stack) > i:
+            self._close(self._stack.pop())
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+            return
+        self._boundary()
+        if tag == "li":
+            # <li> без </li> закрывается следующим <li> того же списка
+            for i in range(len(self._stack) - 1, -1, -1):
+                if self._stack[i]["tag"] in LIST_TAGS:
+                    break
+                if self._stack[i]["tag"] == "li":
+                    self._close_to(i)
+                    break
+        a = dict(attrs)
+        data_id = a.get("data-id")
+        if tag == "a" or tag in CARD_TAGS or tag in LIST_TAGS or data_id is not None:
+            self._stack.append({
+                "tag": tag, "href": a.get("href") if tag == "a" else None, "data_id": data_id,
+                "text": None if tag in LIST_TAGS else [], "len": 0, "links": [], "first": None,
+            })
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skip = max(0, self._skip - 1)
+            return
+        self._boundary()
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i]["tag"] == tag:
+                # незакрытые вложенные теги (в т.ч. <li> при </ul>) закрываем вместе с родителем
+                self._close_to(i)
+                return
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        for e in self._stack:
+            if e["text"] is not None:
+                e["text"].append(data)
+                e["len"] += len(data)
+                if e["len"] > CARD_TEXT_MAX:
+                    e["text"] = None
+
+    def close(self):
+        super().close()
+        self._close_to(0)
+
+    def _text(self, e) -> Optional[str]:
+        return " ".join("".join(e["text"]).split()) if e["text"] is not None else None
+
+    def _close(self, e):
+        if e["tag"] in LIST_TAGS:
+            return
+        if e["tag"] == "a":
+            url = _norm_url(e["href"])
+            if not url:
+                return
+            title = self._text(e) or "Listing"
+            for p in self._stack:
+                if p["data_id"] is not None and p["first"] is None:
+                    p["first"] = (url, title)
+            # внутри [data-id] карточкой считается он сам, а не вложенная обёртка ссылки
+            parent = (next((p for p in reversed(self._stack) if p["data_id"] is not None), None)
+                      or next((p for p in reversed(self._stack) if p["tag"] in CARD_TAGS), None))
+            if parent is not None:
+                parent["links"].append((url, title))
+            else:
+                self._emit_links([(url, title)], title)
+            return
+
+        text = self._text(e)
+        ad_id = e["data_id"]
+        if ad_id and str(ad_id).isdigit() and e["first"]:
+            url, title = e["first"]
+            self.ready.append(_listing(ad_id, url, title, *_parse_fields(text or title)))
+        self._emit_links(e["links"], text, skip_id=ad_id)
+
+    def _emit_links(self, links, text: Optional[str], skip_id: Optional[str] = None):
+        for url, title in links:
+            if not _is_ad_url(url):
+                continue
+            ad_id = _extract_ad_id(url)
+            if not ad_id or ad_id == skip_id:
+                continue
+            self.ready.append(_listing(ad_id, url, title, *_parse_fields(text or title)))
+
+async def stream_listings(session, url: str) -> AsyncIterator[Dict[str, Any]]:
+    """Объявления по мере скачивания страницы (верхние, самые свежие — первыми)."""
+    async with session.get(_prox(url), headers=HDRS) as resp:
+        if resp.status != 200:
+            return
+        try:
+            decoder = codecs.getincrementaldecoder(resp.charset or "utf-8")(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        parser = _CardStreamParser()
+        seen = set()
+
+        def fresh() -> List[Dict[str, Any]]:
+            out = []
+            for it in parser.pop_ready():
+                if it["id"] not in seen:
+                    seen.add(it["id"])
+                    out.append(it)
+            return out
+
+        async for chunk in resp.content.iter_chunked(STREAM_CHUNK):
+            parser.feed(decoder.decode(chunk))
+            for it in fresh():
+                yield it
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        for it in fresh():
+            yield it
+
 async def _fetch_html(session, url: str) -> tuple[int, str]:
     prox_url = _prox(url)
     async with session.get(prox_url, headers=HDRS) as resp:
@@ -195,6 +362,27 @@ async def _fetch_html(session, url: str) -> tuple[int, str]:
         html = await resp.text()
     return status, html or ""
 
+def build_search_url(price_min: Optional[int] = None, price_max: Optional[int] = None,
+                     year_min: Optional[int] = None, year_max: Optional[int] = None,
+                     km_max: Optional[int] = None, brand: Optional[str] = None) -> str:
+    q = {SEARCH_PARAMS["type"]: 100}
+    if SEARCH_SORT_NEWEST:
+        q[SEARCH_PARAMS["sort"]] = SEARCH_SORT_NEWEST
+    if brand and brand in AUTO24_BRAND_IDS:
+        q[SEARCH_PARAMS["brand"]] = AUTO24_BRAND_IDS[brand]
+    for key, val in (("year_min", year_min), ("year_max", year_max),
+                     ("price_min", price_min), ("price_max", price_max), ("km_max", km_max)):
+        if val is not None:
+            q[SEARCH_PARAMS[key]] = val
+    return SEARCH_URL + "?" + urlencode(q)
+
+async def fetch_search_listings(session, url: str) -> List[Dict[str, Any]]:
+    st, html = await _fetch_html(session, url)
+    if st != 200 or not html:
+        return []
+    soup = BeautifulSoup(html, "html.parser")
+    return _collect_from_mobile(soup)
+
 async def fetch_latest_listings(session) -> List[Dict[str, Any]]:
     """Основной источник — мобилка. Десктоп — запасной."""
     all_items: List[Dict[str, Any]] = []
@@ -228,6 +416,21 @@ async def fetch_latest_listings(session) -> List[Dict[str, Any]]:
 
     return uniq[:60]
 
+async def stream_latest_listings(session) -> AsyncIterator[Dict[str, Any]]:
+    """Потоковый вариант fetch_latest_listings: мобилка, затем десктоп, те же 60 штук."""
+    seen = set()
+    for url in (MOBILE_URL, DESKTOP_URL):
+        try:
+            async for it in stream_listings(session, url):
+                if it["id"] in seen:
+                    continue
+                seen.add(it["id"])
+                yield it
+                if len(seen) >= 60:
+                    return
+        except Exception:
+            pass
+
 async def debug_fetch(session):
     """Диагностика сети/HTML: статусы, размеры и примеры ссылок."""
     out = {
@@ -0,0 +1,252 @@
+import asyncio
+import heapq
+import logging
+import os
+from typing import List, Dict, Any, Optional, Tuple, Set, AsyncIterator
+
+from .auto24 import (
+    AUTO24_BRAND_IDS, build_search_url, fetch_search_listings,
+    stream_listings, stream_latest_listings,
+)
+
+logger = logging.getLogger("car-sniper.planner")
+
+# Бюджет: не больше стольких поисковых страниц за скан и столько одновременно
+PLAN_MAX_QUERIES = int(os.getenv("PLAN_MAX_QUERIES", "6"))
+PLAN_CONCURRENCY = int(os.getenv("PLAN_CONCURRENCY", "3"))
+
+INF = float("inf")
+KM_MERGE_RATIO = 1.5  # пробеги 200k и 250k ещё сливаем, 50k и 300k — нет
+
+def _box(chat_id: int, f: Dict[str, Any], brand: Optional[str]) -> Dict[str, Any]:
+    return {
+        "brand": brand,
+        "price_min": f.get("price_min") or 0,
+        "price_max": f["price_max"] if f.get("price_max") is not None else INF,
+        "year_min": f.get("year_min") or 0,
+        "year_max": f["year_max"] if f.get("year_max") is not None else INF,
+        "km_max": f["km_max"] if f.get("km_max") is not None else INF,
+        "chat_ids": {chat_id},
+    }
+
+def _merge(a: Dict[str, Any], b: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "brand": a["brand"] if a["brand"] == b["brand"] else None,
+        "price_min": min(a["price_min"], b["price_min"]),
+        "price_max": max(a["price_max"], b["price_max"]),
+        "year_min": min(a["year_min"], b["year_min"]),
+        "year_max": max(a["year_max"], b["year_max"]),
+        "km_max": max(a["km_max"], b["km_max"]),
+        "chat_ids": a["chat_ids"] | b["chat_ids"],
+    }
+
+def _covers(big: Dict[str, Any], small: Dict[str, Any]) -> bool:
+    return (
+        (big["brand"] is None or big["brand"] == small["brand"])
+        and big["price_min"] <= small["price_min"] and small["price_max"] <= big["price_max"]
+        and big["year_min"] <= small["year_min"] and small["year_max"] <= big["year_max"]
+        and small["km_max"] <= big["km_max"]
+    )
+
+def _km_close(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    lo, hi = sorted((a["km_max"], b["km_max"]))
+    return hi == lo or (hi != INF and hi <= lo * KM_MERGE_RATIO)
+
+def _mergeable(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """
+    Без давления бюджета сливаем только то, что почти не расширяет поиск:
+    один фильтр внутри другого, либо пересечение и по цене, и по годам при близком пробеге.
+    """
+    if _covers(a, b) or _covers(b, a):
+        return True
+    return (
+        a["price_min"] <= b["price_max"] and b["price_min"] <= a["price_max"]
+        and a["year_min"] <= b["year_max"] and b["year_min"] <= a["year_max"]
+        and _km_close(a, b)
+    )
+
+def _merge_overlapping(boxes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Внутри одной марки сливаем пересекающиеся фильтры, пока есть что сливать."""
+    out: List[Dict[str, Any]] = []
+    for b in sorted(boxes, key=lambda x: x["price_min"]):
+        i = next((i for i, o in enumerate(out) if _mergeable(o, b)), None)
+        while i is not None:
+            b = _merge(out.pop(i), b)
+            i = next((i for i, o in enumerate(out) if _mergeable(o, b)), None)
+        out.append(b)
+    return out
+
+def _gap(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+    """Цена слияния: зазор между ценами; разные марки — дороже любого зазора."""
+    lo, hi = (a, b) if a["price_min"] <= b["price_min"] else (b, a)
+    gap = max(0, hi["price_min"] - lo["price_max"])
+    if a["brand"] != b["brand"]:
+        gap += 10_000_000
+    return gap
+
+def _fit_budget(plan: List[Dict[str, Any]], max_queries: int) -> List[Dict[str, Any]]:
+    """
+    Сливаем соседние (по марке и цене) запросы с наименьшим зазором, пока не влезем в бюджет.
+    Куча по соседним парам: O(n log n) вместо перебора всех пар на каждом шаге.
+    """
+    boxes = sorted(plan, key=lambda q: (q["brand"] or "", q["price_min"]))
+    n = len(boxes)
+    if n <= max_queries:
+        return boxes
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    nxt[-1] = -1
+    ver = [0] * n  # версия бокса: устаревшие пары в куче пропускаем
+    alive = [True] * n
+    heap = [(_gap(boxes[i], boxes[i + 1]), i, i + 1, 0, 0) for i in range(n - 1)]
+    heapq.heapify(heap)
+    count = n
+    while count > max_queries and heap:
+        _, i, j, vi, vj = heapq.heappop(heap)
+        if not (alive[i] and alive[j] and nxt[i] == j and ver[i] == vi and ver[j] == vj):
+            continue
+        boxes[i] = _merge(boxes[i], boxes[j])
+        ver[i] += 1
+        alive[j] = False
+        nxt[i] = nxt[j]
+        if nxt[j] != -1:
+            prev[nxt[j]] = i
+        count -= 1
+        for a, b in ((prev[i], i), (i, nxt[i])):
+            if a != -1 and b != -1:
+                heapq.heappush(heap, (_gap(boxes[a], boxes[b]), a, b, ver[a], ver[b]))
+    return [b for k, b in enumerate(boxes) if alive[k]]
+
+def plan_queries(users: List[Tuple[int, Dict[str, Any]]], max_queries: int = PLAN_MAX_QUERIES) -> List[Dict[str, Any]]:
+    """
+    Объединение фильтров всех пользователей -> небольшой набор поисковых URL.
+    Каждый запрос помнит chat_ids, для которых он нужен.
+    """
+    groups: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for chat_id, f in users:
+        brands = f.get("brands") or []
+        # марку без известного id искать на сайте нельзя — такой фильтр идёт без марки
+        if not brands or any(b not in AUTO24_BRAND_IDS for b in brands):
+            brands = [None]
+        for brand in brands:
+            groups.setdefault(brand, []).append(_box(chat_id, f, brand))
+
+    plan: List[Dict[str, Any]] = []
+    for boxes in groups.values():
+        plan += _merge_overlapping(boxes)
+
+    # запросы по марке, целиком покрытые общим запросом, не нужны
+    generic = [q for q in plan if q["brand"] is None]
+    kept: List[Dict[str, Any]] = []
+    for q in plan:
+        big = next((g for g in generic if g is not q and _covers(g, q)), None) if q["brand"] else None
+        if big is not None:
+            big["chat_ids"] |= q["chat_ids"]
+        else:
+            kept.append(q)
+    plan = kept
+
+    # укладываемся в бюджет: сливаем самые близкие пары
+    plan = _fit_budget(plan, max(1, max_queries))
+
+    for q in plan:
+        q["url"] = build_search_url(
+            price_min=q["price_min"] or None,
+            price_max=None if q["price_max"] == INF else q["price_max"],
+            year_min=q["year_min"] or None,
+            year_max=None if q["year_max"] == INF else q["year_max"],
+            km_max=None if q["km_max"] == INF else q["km_max"],
+            brand=q["brand"],
+        )
+    return plan
+
+# План пересчитываем только когда поменялись фильтры
+_cached_sig = None
+_cached_plan: List[Dict[str, Any]] = []
+
+def shared_plan(users: List[Tuple[int, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    global _cached_sig, _cached_plan
+    sig = (PLAN_MAX_QUERIES, tuple(sorted((uid, repr(sorted(f.items()))) for uid, f in users)))
+    if sig != _cached_sig:
+        _cached_plan = plan_queries(users)
+        _cached_sig = sig
+        logger.info("План запросов обновлён: %d URL", len(_cached_plan))
+    return _cached_plan
+
+async def fetch_planned(session, plan: List[Dict[str, Any]], concurrency: int = PLAN_CONCURRENCY) -> List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """Параллельно качаем URL плана; ошибка одного запроса не валит остальные."""
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(q):
+        async with sem:
+            try:
+                return q, await fetch_search_listings(session, q["url"])
+            except Exception as e:
+                logger.warning("Planned fetch failed %s: %s", q["url"], e)
+                return q, []
+
+    return list(await asyncio.gather(*(one(q) for q in plan)))
+
+def route(results: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]) -> Tuple[List[Dict[str, Any]], Dict[str, Set[int]]]:
+    """Уникальные объявления + кому из подписчиков каждое относится."""
+    items: List[Dict[str, Any]] = []
+    audience: Dict[str, Set[int]] = {}
+    for q, listings in results:
+        for it in listings:
+            if it["id"] not in audience:
+                audience[it["id"]] = set()
+                items.append(it)
+            audience[it["id"]] |= q["chat_ids"]
+    return items, audience
+
+async def stream_all(session, plan: List[Dict[str, Any]], concurrency: int = PLAN_CONCURRENCY) -> AsyncIterator[Tuple[Dict[str, Any], Optional[Set[int]]]]:
+    """
+    Потоковый режим: «свежая» лента и URL плана качаются параллельно,
+    (объявление, подписчики) отдаются по мере разбора. None — для всех.
+    Повтор того же id отдаётся ещё раз только для новых подписчиков.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def produce(agen, audience, url):
+        try:
+            async for it in agen:
+                await queue.put((it, audience))
+        except Exception as e:
+            logger.warning("Stream failed %s: %s", url, e)
+        finally:
+            await queue.put(None)
+
+    async def planned(q):
+        async with sem:
+            await produce(stream_listings(session, q["url"]), q["chat_ids"], q["url"])
+
+    tasks = [asyncio.create_task(produce(stream_latest_listings(session), None, "latest"))]
+    tasks += [asyncio.create_task(planned(q)) for q in plan]
+
+    done: Dict[str, Optional[Set[int]]] = {}
+    pending = len(tasks)
+    try:
+        while pending:
+            item = await queue.get()
+            if item is None:
+                pending -= 1
+                continue
+            it, audience = item
+            if it["id"] in done:
+                prev = done[it["id"]]
+                if prev is None:
+                    continue
+                if audience is not None:
+                    audience = audience - prev
+                    if not audience:
+                        continue
+                    done[it["id"]] = prev | audience
+                else:
+                    done[it["id"]] = None
+            else:
+                done[it["id"]] = None if audience is None else set(audience)
+            yield it, audience
+    finally:
+        for t in tasks:
+            t.cancel()
@@ -0,0 +1,12 @@
+import pytest
+
+import db
+
+@pytest.fixture
+def tmp_db(tmp_path, monkeypatch):
+    """Отдельная SQLite-база на тест."""
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr(db, "_conn", None)
+    db.init_db()
+    yield db
+    db.db().close()
@@ -0,0 +1,66 @@
+from dedup import RelistIndex
+
+BASE = {"title": "Toyota Avensis 2.0 D-4D Wagon", "brand": "Toyota", "year": 2010}
+
+def car(listing_id, km, price, **kw):
+    return dict(BASE, id=listing_id, odometer_km=km, price_eur=price, **kw)
+
+def test_relist_with_new_id_is_detected():
+    ix = RelistIndex()
+    assert ix.check_and_add(car("auto24:1", 245000, 4990)) is None
+    assert ix.check_and_add(car("auto24:2", 245100, 4700)) == ["auto24:1"]
+
+def test_same_model_different_km_is_another_car():
+    ix = RelistIndex()
+    ix.check_and_add(car("auto24:1", 245000, 4990))
+    assert ix.check_and_add(car("auto24:2", 120000, 4990)) is None
+
+def test_chain_resolves_to_whole_cluster():
+    ix = RelistIndex()
+    ix.check_and_add(car("auto24:1", 245000, 5500))
+    ix.check_and_add(car("auto24:2", 245000, 4990))
+    # ближе всего к auto24:2, но в ответе должен быть и исходный auto24:1
+    assert ix.check_and_add(car("auto24:3", 245000, 4990)) == ["auto24:1", "auto24:2"]
+
+def test_original_is_not_flagged_as_relist_of_later_copy():
+    ix = RelistIndex()
+    ix.check_and_add(car("auto24:1", 245000, 4990))
+    ix.check_and_add(car("auto24:2", 245000, 4990))
+    assert ix.check_and_add(car("auto24:1", 245000, 4990)) is None
+
+def test_listings_without_price_or_km_are_not_compared():
+    ix = RelistIndex()
+    golf = {"title": "Volkswagen Golf", "brand": "Volkswagen", "year": 2012}
+    assert ix.check_and_add(dict(golf, id="auto24:1")) is None
+    assert ix.check_and_add(dict(golf, id="auto24:2")) is None
+
+def test_same_brand_year_price_but_other_model_is_not_a_relist():
+    ix = RelistIndex()
+    ix.check_and_add(dict(id="auto24:1", title="Toyota Avensis", brand="Toyota", year=2010,
+                          odometer_km=240000, price_eur=4990))
+    assert ix.check_and_add(dict(id="auto24:2", title="Toyota Corolla", brand="Toyota", year=2010,
+                                 odometer_km=241000, price_eur=4990)) is None
+
+def test_same_engine_other_model_is_not_a_relist():
+    ix = RelistIndex()
+    ix.check_and_add(dict(id="auto24:1", title="VW Golf 1.6 TDI", brand="Volkswagen", year=2012,
+                          odometer_km=210000, price_eur=6500))
+    assert ix.check_and_add(dict(id="auto24:2", title="VW Passat 2.0 TDI", brand="Volkswagen", year=2012,
+                                 odometer_km=212000, price_eur=6500)) is None
+
+def test_clusters_survive_restart_when_seeded_from_db(tmp_db, monkeypatch):
+    import dedup
+
+    tmp_db.store_listings([car("auto24:1", 245000, 5500)])
+    tmp_db.store_listings([car("auto24:2", 245000, 4990)])
+    tmp_db.mark_sent(42, "auto24:1", 5500, BASE["title"], "")
+
+    # «перезапуск»: индекс пустой, заполняется из БД
+    monkeypatch.setattr(dedup, "_shared", None)
+    ix = dedup.shared_relist_index(lambda: tmp_db.recent_listings(dedup.RELIST_WINDOW_DAYS))
+    assert len(ix) == 2
+
+    # ближе всего к auto24:2, но кластер должен дойти до отправленного auto24:1
+    earlier = ix.check_and_add(car("auto24:3", 245000, 4990))
+    assert earlier == ["auto24:1", "auto24:2"]
+    assert tmp_db.last_sent_price(42, earlier) == (True, 5500)
@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+
+from app import is_match, listing_text, parse_filters_text, parse_keywords
+from matcher import KeywordMatcher
+
+LISTINGS = [
+    {"id": "auto24:1", "title": "Škoda Octavia 1.9 TDI", "brand": "Skoda"},
+    {"id": "auto24:2", "title": "Volkswagen Golf Variant 4x4", "brand": "Volkswagen"},
+    {"id": "auto24:3", "title": "Golfplatz Shuttle", "brand": None},
+    {"id": "auto24:4", "title": "Toyota Avensis defektiga", "brand": "Toyota"},
+]
+
+def test_matches_whole_tokens_only():
+    m = KeywordMatcher(["Golf", "4x4"])
+    assert m.find("VW Golf Variant 4x4") == {"golf", "4x4"}
+    assert m.find("Golfplatz") == set()
+
+def test_folds_diacritics_both_ways():
+    assert KeywordMatcher(["skoda"]).find("Škoda Octavia") == {"skoda"}
+    assert KeywordMatcher(["Škoda"]).find("Skoda Octavia") == {"skoda"}
+
+def test_parse_keywords_splits_on_pipe_and_minus():
+    assert parse_keywords("Golf|4x4, -defektiga") == (["golf", "4x4"], ["defektiga"])
+    # так же, как filter_keywords собирает поле фильтра
+    inc, exc = parse_keywords("Golf|4x4, -defektiga")
+    f = parse_filters_text("||||" + ",".join(inc + ["-" + k for k in exc]))
+    assert (f["keywords"], f["exclude"]) == (["golf", "4x4"], ["defektiga"])
+
+def test_is_match_keywords_and_excludes_without_shared_hits():
+    f = parse_filters_text("|||" + "|avensis,octavia,-defektiga")
+    got = [it["id"] for it in LISTINGS if is_match(it, f)]
+    assert got == ["auto24:1"]
+
+def test_is_match_uses_passed_hits():
+    f = parse_filters_text("||||golf")
+    item = LISTINGS[1]
+    assert is_match(item, f, hits={"golf"})
+    assert not is_match(item, f, hits=set())
+
+def test_fts_backfill_agrees_with_live_matcher(tmp_db):
+    tmp_db.store_listings(LISTINGS)
+    for kw in ["skoda", "Škoda", "octavia", "golf", "4x4", "avensis"]:
+        m = KeywordMatcher([kw])
+        live = {it["id"] for it in LISTINGS if m.find(listing_text(it))}
+        fts = {it["id"] for it in tmp_db.search_listings([kw])}
+        assert fts == live, kw
+
+def test_prune_drops_stale_listings_from_fts(tmp_db):
+    old = (datetime.now(timezone.utc) - timedelta(days=40)).isoformat()
+    tmp_db.store_listings([dict(LISTINGS[1], fetched_at=old), LISTINGS[0]])
+    assert tmp_db.prune_listings(30) == 1
+    assert tmp_db.search_listings(["golf"]) == []
+    assert [it["id"] for it in tmp_db.search_listings(["octavia"])] == ["auto24:1"]
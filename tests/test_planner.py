@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import pytest
+
+from scraper import auto24
+from scraper.planner import plan_queries, route, stream_all
+
+def filt(pmin, pmax, ymin=None, ymax=None, km=None, brands=()):
+    return {"price_min": pmin, "price_max": pmax, "year_min": ymin, "year_max": ymax,
+            "km_max": km, "brands": list(brands)}
+
+@pytest.fixture(autouse=True)
+def brand_ids(monkeypatch):
+    monkeypatch.setitem(auto24.AUTO24_BRAND_IDS, "Toyota", "1")
+    monkeypatch.setitem(auto24.AUTO24_BRAND_IDS, "BMW", "2")
+
+def _all_chat_ids(plan):
+    return set().union(*(q["chat_ids"] for q in plan))
+
+def test_disjoint_filters_of_one_brand_stay_separate():
+    users = [
+        (1, filt(1000, 3000, 2000, 2004, 300000, ["Toyota"])),
+        (2, filt(2500, 20000, 2019, 2023, 50000, ["Toyota"])),
+    ]
+    plan = plan_queries(users)
+    assert sorted(q["chat_ids"] for q in plan) == [{1}, {2}]
+
+def test_overlapping_filters_merge_and_keep_both_subscribers():
+    users = [
+        (1, filt(2000, 6000, 2003, 2010, 280000, ["Toyota"])),
+        (2, filt(3000, 8000, 2005, 2012, 250000, ["Toyota"])),
+    ]
+    (q,) = plan_queries(users)
+    assert q["chat_ids"] == {1, 2}
+    assert (q["price_min"], q["price_max"], q["year_min"], q["year_max"]) == (2000, 8000, 2003, 2012)
+    assert "b=1" in q["url"] and "ae=" in q["url"]
+
+def test_brand_query_is_folded_into_covering_generic_query():
+    users = [
+        (1, filt(3000, 5000, 2005, 2008, 250000, ["Toyota"])),
+        (2, filt(1000, 20000, 2000, 2024)),
+    ]
+    (q,) = plan_queries(users)
+    assert q["brand"] is None and q["chat_ids"] == {1, 2}
+
+def test_brand_without_search_id_goes_brandless():
+    (q,) = plan_queries([(1, filt(1000, 2000, brands=["Lada"]))])
+    assert q["brand"] is None and "b=" not in q["url"]
+
+def test_budget_is_enforced_and_no_subscriber_is_lost():
+    users = [(i, filt(i * 1000, i * 1000 + 500, brands=["Toyota" if i % 2 else "BMW"])) for i in range(1, 41)]
+    plan = plan_queries(users, max_queries=6)
+    assert len(plan) == 6
+    assert _all_chat_ids(plan) == set(range(1, 41))
+    # каждый пользователь попал в запрос, который покрывает его цены
+    for uid, f in users:
+        assert any(uid in q["chat_ids"] and q["price_min"] <= f["price_min"] and f["price_max"] <= q["price_max"]
+                   for q in plan)
+
+def test_budget_prefers_merging_within_a_brand():
+    users = [(1, filt(1000, 2000, brands=["Toyota"])), (2, filt(3000, 4000, brands=["Toyota"])),
+             (3, filt(1000, 2000, brands=["BMW"]))]
+    plan = plan_queries(users, max_queries=2)
+    assert sorted((q["brand"], sorted(q["chat_ids"])) for q in plan) == [("BMW", [3]), ("Toyota", [1, 2])]
+
+def test_budget_with_many_filters_is_fast():
+    users = [(i, filt(i * 100, i * 100 + 50)) for i in range(2000)]
+    t = time.perf_counter()
+    plan = plan_queries(users, max_queries=6)
+    assert time.perf_counter() - t < 5
+    assert len(plan) == 6 and _all_chat_ids(plan) == set(range(2000))
+
+def test_route_unions_audiences_of_queries():
+    a, b = {"id": "auto24:1"}, {"id": "auto24:2"}
+    items, audience = route([({"chat_ids": {1}}, [a, b]), ({"chat_ids": {2}}, [a])])
+    assert [it["id"] for it in items] == ["auto24:1", "auto24:2"]
+    assert audience == {"auto24:1": {1, 2}, "auto24:2": {1}}
+
+def _card(ad_id):
+    return f'<li><a href="/soidukid/{ad_id}">Toyota Avensis</a> 2010 245 000 km 4 990 €</li>'
+
+class _Content:
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def iter_chunked(self, n):
+        for i in range(0, len(self._body), 16):
+            await asyncio.sleep(0)
+            yield self._body[i:i + 16]
+
+class _Resp:
+    status = 200
+    charset = "utf-8"
+
+    def __init__(self, body: bytes):
+        self.content = _Content(body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class _Session:
+    def __init__(self, pages):
+        self._pages = pages
+
+    def get(self, url, **kw):
+        body = next((v for k, v in self._pages.items() if k in url), "")
+        return _Resp(("<ul>" + body + "</ul>").encode())
+
+def test_stream_all_routes_planned_listings_only_to_their_subscribers():
+    pages = {
+        "m.auto24.ee/soidukid": _card(1111111),
+        "www.auto24.ee/soidukid": _card(2222222),
+        "g1=1000": _card(3333333) + _card(1111111),
+        "g1=50000": _card(4444444) + _card(3333333),
+    }
+    plan = [{"url": auto24.build_search_url(price_min=1000), "chat_ids": {7}},
+            {"url": auto24.build_search_url(price_min=50000), "chat_ids": {8}}]
+
+    async def run():
+        return [(it["id"], aud) async for it, aud in stream_all(_Session(pages), plan)]
+
+    got = asyncio.run(run())
+    by_id = {}
+    for listing_id, aud in got:
+        by_id.setdefault(listing_id, []).append(aud)
+    # «свежая» лента — всем, и повтор из плана уже не нужен
+    assert by_id["auto24:1111111"] == [None]
+    assert by_id["auto24:2222222"] == [None]
+    assert by_id["auto24:4444444"] == [{8}]
+    # один и тот же id из двух запросов: второй раз — только новым подписчикам
+    assert sorted(map(sorted, by_id["auto24:3333333"])) == [[7], [8]]
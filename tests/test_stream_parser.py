@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+from bs4 import BeautifulSoup
+
+from scraper.auto24 import _CardStreamParser, _collect_from_mobile, stream_listings
+
+FIELDS = ("id", "url", "title", "price_eur", "year", "odometer_km", "brand")
+
+# Явно закрытые карточки и [data-id] с обёрткой вокруг ссылки.
+PAGE = """<html><head><script>var tpl = "<li><a href='/soidukid/9999999'>x</a> 1 000 €</li>";</script></head>
+<body><div class="page">
+<ul class="results">
+<li><a href="/soidukid/1111111">Skoda Octavia</a><span>2015</span><span>150 000 km</span><span>8 900 €</span></li>
+<li><a href="/soidukid/2222222">Volvo V70 D5</a> <span>2008</span> <span>310 000 km</span> <span>3 500 €</span></li>
+<li><div data-id="3333333"><div class="title"><a href="/soidukid/3333333">BMW 320d</a></div>
+    <span>2016</span><span>180 000 km</span><span>12 500 €</span></div></li>
+</ul>
+</div></body></html>"""
+
+# Неявно закрытые <li> (валидный HTML).
+IMPLICIT_LI = """<div class="page"><ul class="more">
+<li><a href="/soidukid/4444444">Audi A4 Avant</a> 2011 &middot; 240 000 km &middot; 6 200 €
+<li><a href="/soidukid/5555555">Skoda Superb</a> 2013 &middot; 199 000 km &middot; 3 900 €
+<li><a href="/login.php">Logi sisse</a>
+</ul></div>"""
+
+def _stream(html: str, size: int):
+    p = _CardStreamParser()
+    out, seen = [], set()
+    for i in range(0, len(html), size):
+        p.feed(html[i:i + size])
+        out += p.pop_ready()
+    p.close()
+    out += p.pop_ready()
+    uniq = []
+    for it in out:
+        if it["id"] not in seen:
+            seen.add(it["id"])
+            uniq.append(it)
+    return uniq
+
+def _fields(items):
+    return {it["id"]: tuple(it[k] for k in FIELDS) for it in items}
+
+@pytest.mark.parametrize("size", [1, 7, 64, len(PAGE)])
+def test_stream_matches_soup_collector(size):
+    expected = _collect_from_mobile(BeautifulSoup(PAGE, "html.parser"))
+    got = _stream(PAGE, size)
+    assert _fields(got) == _fields(expected)
+
+@pytest.mark.parametrize("size", [1, 7, len(PAGE)])
+def test_fields_and_titles_survive_chunk_boundaries(size):
+    got = {it["id"]: it for it in _stream(PAGE, size)}
+    octavia = got["auto24:1111111"]
+    assert (octavia["title"], octavia["year"], octavia["odometer_km"], octavia["price_eur"]) == \
+        ("Skoda Octavia", 2015, 150000, 8900)
+    assert got["auto24:2222222"]["title"] == "Volvo V70 D5"
+
+def test_data_id_card_with_inner_wrapper_is_emitted_once_and_complete():
+    got = [it for it in _stream(PAGE, 7) if it["id"] == "auto24:3333333"]
+    assert len(got) == 1
+    assert (got[0]["year"], got[0]["odometer_km"], got[0]["price_eur"]) == (2016, 180000, 12500)
+
+def test_implicitly_closed_li_is_emitted_in_page_order_before_wrapper_closes():
+    p = _CardStreamParser()
+    cut = IMPLICIT_LI.index('<li><a href="/soidukid/5555555">')
+    p.feed(IMPLICIT_LI[:cut + len("<li>")])
+    assert [it["id"] for it in p.pop_ready()] == ["auto24:4444444"]
+
+    got = _stream(IMPLICIT_LI, 7)
+    assert [it["id"] for it in got] == ["auto24:4444444", "auto24:5555555"]
+    assert [(it["brand"], it["price_eur"], it["odometer_km"]) for it in got] == \
+        [("Audi", 6200, 240000), ("Skoda", 3900, 199000)]
+
+class _Content:
+    def __init__(self, body: bytes, size: int):
+        self._body, self._size = body, size
+
+    async def iter_chunked(self, n):
+        for i in range(0, len(self._body), self._size):
+            yield self._body[i:i + self._size]
+
+class _Resp:
+    status = 200
+    charset = "utf-8"
+
+    def __init__(self, body: bytes, size: int):
+        self.content = _Content(body, size)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class _Session:
+    def __init__(self, body: bytes, size: int):
+        self._body, self._size = body, size
+
+    def get(self, url, **kw):
+        return _Resp(self._body, self._size)
+
+def test_stream_listings_decodes_split_multibyte_chars():
+    async def run():
+        body = IMPLICIT_LI.replace("Skoda Superb", "Škoda Superb").encode()
+        return [it async for it in stream_listings(_Session(body, 5), "https://m.auto24.ee/soidukid/kasutatud/")]
+
+    got = asyncio.run(run())
+    assert [it["id"] for it in got][-1] == "auto24:5555555"
+    assert got[-1]["title"] == "Škoda Superb"